@@ -82,6 +82,9 @@ def add_fp16_config_args(parser):
 
     group.add_argument('--fp16', action='store_true',
                        help='Run model in fp16 mode')
+    group.add_argument('--amp', action='store_true',
+                       help='Finetune with torch autocast and a GradScaler '
+                            'instead of the fp16 model/optimizer wrappers')
     group.add_argument('--fp32-embedding', action='store_true',
                        help='embedding in fp32')
     group.add_argument('--fp32-layernorm', action='store_true',
@@ -124,10 +127,16 @@ def add_training_args(parser):
                        help='chunk size (number of layers) for checkpointing')
     group.add_argument('--deepspeed-activation-checkpointing', action='store_true',
                        help='uses activation checkpointing from deepspeed')
+    group.add_argument('--compile', action='store_true',
+                       help='compile the model with torch.compile for finetuning '
+                            '(requires PyTorch >= 2.2)')
     group.add_argument('--epochs', type=int, default=None,
                        help='Number of finetuning epochs. Zero results in evaluation only.')
     group.add_argument('--clip-grad', type=float, default=1.0,
                        help='gradient clipping')
+    group.add_argument('--zero-grads-in-place', action='store_true',
+                       help='Fill gradients with zeros between steps instead of '
+                            'setting them to None')
     group.add_argument('--train-iters', type=int, default=0,
                        help='total number of iterations to train over all training runs')
     group.add_argument('--label-smoothing', type=float, default=0.0)
@@ -308,6 +317,11 @@ def add_data_args(parser):
                             'each document consists of newline separated sentences')
     group.add_argument('--num-workers', type=int, default=2,
                        help="""Number of workers to use for dataloading""")
+    group.add_argument('--prefetch-factor', type=int, default=2,
+                       help="""Number of batches loaded in advance by each worker""")
+    group.add_argument('--no-pin-memory', action='store_true',
+                       help='Do not pin the host memory of finetuning batches. '
+                            'Saves host memory on very large datasets.')
     group.add_argument('--tokenizer-model-type', type=str,
                        default=None,
                        help="Model type to use for sentencepiece tokenization \
@@ -444,6 +458,16 @@ def get_args():
         if args.rank == 0:
             print(' > using dynamic loss scaling')
 
+    assert not (args.amp and args.fp16), '--amp and --fp16 are mutually exclusive'
+    assert not (args.amp and args.deepspeed), '--amp is not supported with --deepspeed'
+    # GradScaler decides on overflow per rank; the fp16 loss scaler syncs it across the model-parallel group.
+    assert not (args.amp and args.model_parallel_size > 1), '--amp is not supported with model parallelism'
+    assert not (args.compile and args.checkpoint_activations), \
+        '--compile and --checkpoint-activations are mutually exclusive'
+    assert not (args.compile and args.deepspeed), '--compile is not supported with --deepspeed'
+    assert not args.compile or hasattr(torch.nn.Module, 'compile'), \
+        '--compile requires PyTorch >= 2.2 (nn.Module.compile), found {}'.format(torch.__version__)
+
     # The args fp32_* or fp16_* meant to be active when the
     # args fp16 is set. So the default behaviour should all
     # be false.
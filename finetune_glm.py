@@ -2,10 +2,11 @@
 
 import os
 import json
+import itertools
 
 import random
 
-from tasks.data_utils import build_data_loader, FakeDataloader
+from tasks.data_utils import build_data_loader, flat_collate, FakeDataloader
 from utils import get_sample_writer, get_log_dir, print_and_save_args, debug_finetune_data
 from arguments import get_args
 from filelock import FileLock
@@ -15,6 +16,7 @@ import pathlib
 import mpu
 
 import torch
+import torch.nn.functional as F
 import torch.utils.data
 from configure_data import prepare_tokenizer
 
@@ -52,10 +54,9 @@ def process_batch(batch, args):
     data_b = mpu.broadcast_data(keys, batch, datatype)
 
     if "padding_mask" in data_b:
-        attention_mask = data_b['padding_mask'].float().cuda().contiguous()
-        if args.fp16:
-            attention_mask = attention_mask.half()
-        data_b["padding_mask"] = attention_mask
+        # The broadcast data already lives on the device, so only the dtype changes here.
+        mask_dtype = torch.half if args.fp16 else torch.float
+        data_b["padding_mask"] = data_b['padding_mask'].to(dtype=mask_dtype)
     return data_b
 
 
@@ -138,9 +139,9 @@ def finetune_forward_step(batch, model, args, timers, mems):
             loss_mask = data["loss_mask"]
             logits = logits * loss_mask - 10000.0 * (1.0 - loss_mask)
         if args.loss_func == "cross_entropy":
-            # Cross-entropy loss.
-            loss_func = torch.nn.CrossEntropyLoss()
-            loss = loss_func(logits.contiguous().float(), labels)
+            # Cross-entropy loss. Autocast already runs it in fp32, so only
+            # the half precision model needs an explicit fp32 copy.
+            loss = F.cross_entropy(logits.float() if args.fp16 else logits, labels)
         elif args.loss_func == "hinge":
             correct_logits = logits[range(logits.size(0)), labels]
             hinge_loss = 1 + logits - correct_logits.unsqueeze(1)
@@ -150,8 +151,7 @@ def finetune_forward_step(batch, model, args, timers, mems):
             batch_size = logits.size(0)
             loss = - logits[range(batch_size), labels].mean()
             if args.loss_func == "mix":
-                loss_func = torch.nn.CrossEntropyLoss()
-                loss = loss + loss_func(logits.contiguous().float(), labels)
+                loss = loss + F.cross_entropy(logits.float() if args.fp16 else logits, labels)
         else:
             raise NotImplementedError
 
@@ -160,22 +160,54 @@ def finetune_forward_step(batch, model, args, timers, mems):
     return loss, mems, 'bert'
 
 
-def _build_infinite_size_dataloader(dataloader):
-    """Build a looped dataloader with infinite size."""
+def _to_cuda_async(batch):
+    """Start copying a collated FlatBatch to the current device."""
+    if batch is None:
+        return batch
+    return batch.cuda(non_blocking=True)
 
-    iterator = dataloader.__iter__()
-    while True:
-        try:
-            yield iterator.__next__()
-        except StopIteration:
-            iterator = dataloader.__iter__()
+
+def _prefetch_to_cuda(dataloader):
+    """Iterate over the dataloader. The next batch is copied on a side stream
+    while the current one is trained on."""
+    copy_stream = torch.cuda.Stream()
+
+    def prefetch(batch):
+        with torch.cuda.stream(copy_stream):
+            return _to_cuda_async(batch)
+
+    def ready(batch):
+        # The compute stream waits for the copy, and the copied memory is kept
+        # alive until the compute stream is done with it.
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_stream(copy_stream)
+        if batch is not None:
+            for value in batch.values():
+                if torch.is_tensor(value):
+                    value.record_stream(compute_stream)
+        return batch
+
+    iterator = iter(dataloader)
+    try:
+        next_batch = prefetch(next(iterator))
+    except StopIteration:
+        return
+    for batch in iterator:
+        # Wait for the current batch before queueing the next copy, so that
+        # the compute stream does not wait for the next transfer as well.
+        current_batch = ready(next_batch)
+        next_batch = prefetch(batch)
+        yield current_batch
+    yield ready(next_batch)
 
 
 def _build_train_valid_dataloaders(train_dataset, valid_dataset, args):
     """Traing and validation dataloaders."""
     print_rank_0('building train and validation dataloaders ...')
     # Training dataset.
-    train_dataloader = build_data_loader(train_dataset, args.batch_size, args.num_workers, drop_last=False)
+    train_dataloader = build_data_loader(train_dataset, args.batch_size, args.num_workers, drop_last=False,
+                                         prefetch_factor=args.prefetch_factor, pin_memory=not args.no_pin_memory,
+                                         collate_fn=flat_collate, persistent_workers=True)
     # Set the training iterations.
     args.train_iters_per_epoch = len(train_dataloader)
     args.train_iters = args.epochs * args.train_iters_per_epoch
@@ -184,22 +216,26 @@ def _build_train_valid_dataloaders(train_dataset, valid_dataset, args):
     valid_dataloader = None
     if valid_dataset is not None:
         valid_dataloader_ = build_data_loader(valid_dataset, args.batch_size,
-                                              args.num_workers, drop_last=False)
-        valid_dataloader = _build_infinite_size_dataloader(valid_dataloader_)
+                                              args.num_workers, drop_last=False,
+                                              prefetch_factor=args.prefetch_factor,
+                                              pin_memory=not args.no_pin_memory)
+        # Restart the dataloader whenever a pass ends, without a python-level generator per batch.
+        valid_dataloader = itertools.chain.from_iterable(itertools.repeat(valid_dataloader_))
 
     return train_dataloader, valid_dataloader
 
 
 def _train(model, optimizer, lr_scheduler, forward_step,
-           train_dataloader, valid_dataloader, end_of_epoch_callback, args, timers, summary_writer=None):
+           train_dataloader, valid_dataloader, end_of_epoch_callback, args, timers, summary_writer=None,
+           scaler=None):
     """Train the model."""
 
     # Turn on training mode which enables dropout.
     model.train()
 
-    # Tracking loss.
+    # Tracking loss. It stays on the device and is only synchronized at log time.
     args.iteration = 0
-    total_lm_loss = 0.0
+    total_lm_loss = torch.zeros(1, device=torch.cuda.current_device())
     best_score, best_iteration = 0, None
     # Starting epoch and iteration
     start_epoch = args.iteration // args.train_iters_per_epoch
@@ -215,14 +251,17 @@ def _train(model, optimizer, lr_scheduler, forward_step,
         if mpu.get_model_parallel_rank() == 0:
             train_dataloader[0].sampler.set_epoch(args.seed + epoch)
 
-        # For all the batches in the dataset.
-        for iteration_, batch in enumerate(train_dataloader[0]):
+        # For all the batches in the dataset. The iterations before the starting
+        # value are dropped before they are copied to the device.
+        batches = itertools.islice(train_dataloader[0], start_iteration, None)
+        # Set to zero so the next epoch does not skip any batches.
+        start_iteration = 0
+        for batch in _prefetch_to_cuda(batches):
 
-            # Ignore the iterations before starting value
-            if iteration_ < start_iteration:
-                continue
-            # Set to zero so the next epoch does not skip any batches.
-            start_iteration = 0
+            if args.compile:
+                # Start a new iteration for the CUDA graphs recorded by the compiled model,
+                # so they can be replayed over the outputs of the previous step.
+                torch.compiler.cudagraph_mark_step_begin()
 
             # Train for one step.
             if args.block_lm_ratio > 0.0:
@@ -230,9 +269,10 @@ def _train(model, optimizer, lr_scheduler, forward_step,
             else:
                 data = batch
             lm_loss, skipped_iter, _ = train_step(data, model, optimizer, lr_scheduler, args,
-                                                  timers, forward_step_func=forward_step, single_step=True)
+                                                  timers, forward_step_func=forward_step, single_step=True,
+                                                  scaler=scaler)
             args.iteration += 1
-            total_lm_loss += lm_loss.data.detach().float()
+            total_lm_loss += lm_loss
 
             # Logging.
             if args.iteration % args.log_interval == 0:
@@ -244,7 +284,7 @@ def _train(model, optimizer, lr_scheduler, forward_step,
                 report_iteration_metrics(summary_writer, optimizer, learning_rate, avg_lm_loss,
                                          elapsed_time * 1000.0 / args.log_interval, args.iteration, args.train_iters,
                                          args)
-                total_lm_loss = 0.0
+                total_lm_loss.zero_()
 
             # Evaluation
             if args.eval_interval and valid_dataloader is not None and args.iteration % args.eval_interval == 0:
@@ -255,7 +295,8 @@ def _train(model, optimizer, lr_scheduler, forward_step,
 
         # Checkpointing at the end of each epoch.
         if args.save and (epoch + 1) % args.save_epoch == 0:
-            save_checkpoint(args.iteration, model, optimizer, lr_scheduler, args, only_changed_parameters=True)
+            save_checkpoint(args.iteration, model, optimizer, lr_scheduler, args, only_changed_parameters=True,
+                            scaler=scaler)
 
         # Callback at the end of each epoch.
         if end_of_epoch_callback is not None and (epoch + 1) % args.eval_epoch == 0:
@@ -342,6 +383,8 @@ def finetune(args, train_valid_datasets_provider, model_kwargs, forward_step=fin
     # Build model, optimizer and learning rate scheduler.
     timers('model and optimizer').start()
     model, optimizer, lr_scheduler = setup_model_and_optimizer(args, **model_kwargs)
+    # Dynamic loss scaling for the autocast path; --fp16 keeps using FP16_Optimizer.
+    scaler = torch.amp.GradScaler("cuda") if args.amp else None
     timers('model and optimizer').stop()
 
     # If pretrained checkpoint is provided and we have not trained for
@@ -386,7 +429,7 @@ def finetune(args, train_valid_datasets_provider, model_kwargs, forward_step=fin
                 optimizer._model_params_to_master_params()
     if args.load is not None:
         with FileLock(os.path.join(pathlib.Path.home(), "checkpoint_lock"), timeout=-1):
-            load_checkpoint(model, optimizer, lr_scheduler, args, no_deepspeed=args.no_deepspeed_load)
+            load_checkpoint(model, optimizer, lr_scheduler, args, no_deepspeed=args.no_deepspeed_load, scaler=scaler)
         # This is critical when only model is loaded. We should make sure
         # master parameters are also updated.
         if args.fp16 and optimizer is not None:
@@ -396,6 +439,9 @@ def finetune(args, train_valid_datasets_provider, model_kwargs, forward_step=fin
                 optimizer._model_params_to_master_params()
     torch.distributed.barrier()
     timers('pretrained checkpoint').stop()
+    if args.compile:
+        # Compile in place so the DDP/fp16 wrappers and the checkpoint keys stay unchanged.
+        model.compile(mode='reduce-overhead', fullgraph=False)
     args.iteration = 0
     summary_writer = None
     if torch.distributed.get_rank() == 0:
@@ -419,7 +465,7 @@ def finetune(args, train_valid_datasets_provider, model_kwargs, forward_step=fin
         best_iteration = _train(model, optimizer, lr_scheduler, forward_step,
                                 (train_dataloader, train_block_dataloader), (valid_dataloader, valid_block_dataloader),
                                 end_of_epoch_callback, args, timers,
-                                summary_writer=summary_writer)
+                                summary_writer=summary_writer, scaler=scaler)
         if end_of_train_callback is not None and best_iteration is not None:
             with FileLock(os.path.join(pathlib.Path.home(), "checkpoint_lock"), timeout=-1):
                 args.load = os.path.join(args.save, "best")
@@ -442,8 +488,9 @@ def finetune(args, train_valid_datasets_provider, model_kwargs, forward_step=fin
 
 
 if __name__ == '__main__':
-    # Disable CuDNN.
-    torch.backends.cudnn.enabled = False
+    # Let cuDNN autotune kernels for the fixed finetuning shapes and allow TF32 matmuls.
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
 
     # Arguments.
     args = get_args()
@@ -291,9 +291,6 @@ def main():
 
     print('Generate Samples')
 
-    # Disable CuDNN.
-    torch.backends.cudnn.enabled = False
-
     # Arguments.
     args = get_args()
     args.mem_length = args.seq_length + args.mem_length - 1
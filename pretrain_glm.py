@@ -17,6 +17,7 @@
 
 # Flag to use Pytorch ddp which uses overlapping communication and computation.
 from datetime import datetime
+import functools
 import os
 import random
 import math
@@ -44,6 +45,12 @@ from utils import get_sample_writer, get_log_dir, get_hostname
 import torch.distributed as dist
 
 
+@functools.lru_cache(maxsize=None)
+def _get_position_ids(seq_length, device):
+    """Position ids of shape (1, seq_length), built once per length and device."""
+    return torch.arange(seq_length, dtype=torch.long, device=device).unsqueeze(0)
+
+
 def get_masks_and_position_ids(data,
                                eod_token,
                                reset_position_ids,
@@ -74,10 +81,9 @@ def get_masks_and_position_ids(data,
     if loss_mask is None:
         loss_mask = torch.ones(data.size(), dtype=torch.float, device=data.device)
 
-    # Position ids.
-    position_ids = torch.arange(seq_length, dtype=torch.long,
-                                device=data.device)
-    position_ids = position_ids.unsqueeze(0).expand_as(data)
+    # Position ids. The base range only depends on the sequence length and
+    # the device, so it is built once and shared as an expanded view.
+    position_ids = _get_position_ids(seq_length, data.device).expand_as(data)
     if set_loss_mask:
         loss_mask[data == eod_token] = 0.0
     # We need to clone as the ids will be modifed based on batch index.
@@ -114,8 +120,8 @@ def get_two_batch(data, args):
     datatype = torch.int64
     # Broadcast data.
     data_b = mpu.broadcast_data(keys, data, datatype)
-    source_tokens = data_b['text'].long()
-    target_tokens = data_b['target'].long()
+    source_tokens = data_b['text']
+    target_tokens = data_b['target']
     loss_mask = data_b['loss_mask'].float()
     labels = target_tokens[:, 1:].contiguous()
     loss_mask = loss_mask[:, 1:].contiguous()
@@ -164,20 +170,20 @@ def get_batch(data, args):
 
     # Broadcast data.
     data_b = mpu.broadcast_data(keys, data, datatype)
-    # Unpack.
+    # Unpack. The broadcast tensors are already int64.
     if args.transformer_xl:
-        tokens = data_b['text'].long()
-        labels = data_b['target'].long()
+        tokens = data_b['text']
+        labels = data_b['target']
         attention_mask = data_b['attention_mask'].float()
         loss_mask = data_b['loss_mask'].float()
     elif args.block_lm:
-        tokens = data_b['text'].long()
-        labels = data_b['target'].long()
-        attention_mask = data_b['attention_mask'].long()
+        tokens = data_b['text']
+        labels = data_b['target']
+        attention_mask = data_b['attention_mask']
         loss_mask = data_b['loss_mask'].float()
-        position_ids = data_b['position_id'].long()
+        position_ids = data_b['position_id']
     else:
-        tokens_ = data_b['text'].long()
+        tokens_ = data_b['text']
         loss_mask = data_b['loss_mask'].float()
         labels = tokens_[:, 1:].contiguous()
         loss_mask = loss_mask[:, 1:].contiguous()
@@ -322,8 +328,8 @@ def train(model, optimizer, lr_scheduler,
     # Turn on training mode which enables dropout.
     model.train()
 
-    # Tracking loss.
-    total_lm_loss = 0.0
+    # Tracking loss. It stays on the device and is only synchronized at log time.
+    total_lm_loss = torch.zeros(1, device=torch.cuda.current_device())
 
     # Iterations.
     skipped_iters = 0
@@ -342,7 +348,7 @@ def train(model, optimizer, lr_scheduler,
         args.iteration += 1
 
         # Update losses.
-        total_lm_loss += lm_loss.data.detach().float()
+        total_lm_loss += lm_loss
 
         # Logging.
         if args.iteration % args.log_interval == 0:
@@ -351,7 +357,7 @@ def train(model, optimizer, lr_scheduler,
             elapsed_time = timers('interval time').elapsed()
             report_iteration_metrics(summary_writer, optimizer, learning_rate, avg_lm_loss,
                                      elapsed_time * 1000.0 / args.log_interval, args.iteration, args.train_iters, args)
-            total_lm_loss = 0.0
+            total_lm_loss.zero_()
             if report_memory_flag:
                 report_memory('after {} iterations'.format(args.iteration))
                 report_memory_flag = False
@@ -551,8 +557,6 @@ def get_train_val_test_data(args, tokenizer):
 def main():
     """Main training program."""
 
-    # Disable CuDNN.
-    torch.backends.cudnn.enabled = False
     # Timer.
     timers = Timers()
 
@@ -5,4 +5,7 @@ if sys.argv[1] == 'block':
     main()
 elif sys.argv[1] == 'rel_shift':
     from test.test_rel_shift import main
-    main()
\ No newline at end of file
+    main()
+elif sys.argv[1] == 'flat_batch':
+    from test.test_flat_batch import main
+    main()
@@ -299,11 +299,11 @@ def build_sample(ids, types=None, paddings=None, positions=None, masks=None, lab
 
 
 def build_decoder_sample(sample, dec_ids, dec_position, dec_masks, dec_target, dec_logit_mask):
-    sample['dec_text'] = np.array(dec_ids)
-    sample['dec_position'] = np.array(dec_position)
-    sample['dec_mask'] = np.array(dec_masks)
-    sample['dec_target'] = np.array(dec_target)
-    sample['dec_logit_mask'] = np.array(dec_logit_mask)
+    sample['dec_text'] = np.array(dec_ids, dtype=np.int64)
+    sample['dec_position'] = np.array(dec_position, dtype=np.int64)
+    sample['dec_mask'] = np.array(dec_masks, dtype=np.int64)
+    sample['dec_target'] = np.array(dec_target, dtype=np.int64)
+    sample['dec_logit_mask'] = np.array(dec_logit_mask, dtype=np.int64)
     return sample
 
 
@@ -346,6 +346,41 @@ def my_collate(batch):
     return new_batch
 
 
+class FlatBatch:
+    """A collated batch whose tensors are packed into one flat buffer per dtype. The
+    DataLoader pins each buffer once and the batch reaches the device in one copy per dtype."""
+
+    def __init__(self, batch):
+        self.buffers, self.layout, self.others = {}, [], {}
+        tensors_by_dtype = {}
+        for key, value in batch.items():
+            if torch.is_tensor(value):
+                tensors_by_dtype.setdefault(value.dtype, []).append((key, value))
+            else:
+                self.others[key] = value
+        for dtype, items in tensors_by_dtype.items():
+            self.buffers[dtype] = torch.cat([value.reshape(-1) for _, value in items])
+            self.layout += [(key, dtype, value.size()) for key, value in items]
+
+    def pin_memory(self):
+        self.buffers = {dtype: buffer.pin_memory() for dtype, buffer in self.buffers.items()}
+        return self
+
+    def cuda(self, non_blocking=False):
+        """Copy the buffers to the current device and unpack them into a batch dict."""
+        buffers = {dtype: buffer.cuda(non_blocking=non_blocking) for dtype, buffer in self.buffers.items()}
+        batch, offsets = dict(self.others), dict.fromkeys(buffers, 0)
+        for key, dtype, size in self.layout:
+            numel = size.numel()
+            batch[key] = buffers[dtype].narrow(0, offsets[dtype], numel).view(size)
+            offsets[dtype] += numel
+        return batch
+
+
+def flat_collate(batch):
+    return FlatBatch(my_collate(batch))
+
+
 class FakeDataloader:
     def __init__(self, num_iters):
         self.num_iters = num_iters
@@ -359,7 +394,8 @@ class FakeDataloader:
                 yield None
 
 
-def build_data_loader(dataset, batch_size, num_workers, drop_last, shuffle=True, only_rank0=False):
+def build_data_loader(dataset, batch_size, num_workers, drop_last, shuffle=True, only_rank0=False,
+                      prefetch_factor=2, pin_memory=True, collate_fn=my_collate, persistent_workers=False):
     """Data loader. Note that batch-size is the local (per GPU) batch-size."""
 
     # Sampler.
@@ -371,6 +407,12 @@ def build_data_loader(dataset, batch_size, num_workers, drop_last, shuffle=True,
     sampler = torch.utils.data.distributed.DistributedSampler(
         dataset, num_replicas=world_size, rank=rank, shuffle=shuffle)
 
+    # Let each worker run prefetch_factor batches ahead and, if requested, keep the
+    # workers alive across epochs. Both only apply with worker processes.
+    worker_kwargs = {}
+    if num_workers > 0:
+        worker_kwargs = {'persistent_workers': persistent_workers, 'prefetch_factor': prefetch_factor}
+
     # Data loader. Note that batch size is the per GPU batch size.
     data_loader = torch.utils.data.DataLoader(dataset,
                                               batch_size=batch_size,
@@ -378,7 +420,8 @@ def build_data_loader(dataset, batch_size, num_workers, drop_last, shuffle=True,
                                               shuffle=False,
                                               num_workers=num_workers,
                                               drop_last=drop_last,
-                                              pin_memory=True,
-                                              collate_fn=my_collate)
+                                              pin_memory=pin_memory,
+                                              collate_fn=collate_fn,
+                                              **worker_kwargs)
 
     return data_loader
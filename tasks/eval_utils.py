@@ -71,7 +71,8 @@ def accuracy_func_provider(single_dataset_provider, metric_dict, args, is_test=F
         dataset = single_dataset_provider(datapath)
         dataloader = build_data_loader(
             dataset, eval_batch_size, num_workers=args.num_workers,
-            drop_last=False, shuffle=False, only_rank0=only_rank0)
+            drop_last=False, shuffle=False, only_rank0=only_rank0,
+            prefetch_factor=args.prefetch_factor, pin_memory=not args.no_pin_memory)
         dataloaders.append((dataset.dataset_name, dataloader))
 
     def metrics_func(model, epoch, output_predictions=False, summary_writer=None):
@@ -90,7 +90,7 @@ def lm_forward_step(data, model, args, timers, mems, eval_metric=None):
 
     # Forward model.
     if args.continuous_prompt:
-        prompt_pos = data["prompt_pos"].long().cuda()
+        prompt_pos = data["prompt_pos"].cuda(non_blocking=True)
         logits, *mems = model(tokens, position_ids, attention_mask, *mems, prompt_pos=prompt_pos)
     else:
         logits, *mems = model(tokens, position_ids, attention_mask, *mems)
@@ -215,7 +215,8 @@ def metrics_func_provider(args, tokenizer, is_test):
         raise NotImplementedError('{} task is not implemented.'.format(args.task))
     # Data stuff
     dataloader = build_data_loader(dataset, args.eval_batch_size,
-                                   args.num_workers, drop_last=False, shuffle=False)
+                                   args.num_workers, drop_last=False, shuffle=False,
+                                   prefetch_factor=args.prefetch_factor, pin_memory=not args.no_pin_memory)
 
     def metrics_func(model, epoch, output_predictions=False, summary_writer=None):
         return evaluate_and_print_results(dataloader, model, eval_metric=eval_metric, args=args)
@@ -237,9 +237,10 @@ def process_batch(batch, args):
         # finetune SQuAD
         batch['attention_mask'] = batch.pop('mask')
         batch['position_id'] = batch.pop('position')
-    tokens = batch['text'].long().cuda()
-    attention_mask = batch['attention_mask'].long().cuda()
-    position_ids = batch['position_id'].long().cuda()
+    # The samples are built as int64 arrays, so no cast is needed before the copy.
+    tokens = batch['text'].cuda(non_blocking=True)
+    attention_mask = batch['attention_mask'].cuda(non_blocking=True)
+    position_ids = batch['position_id'].cuda(non_blocking=True)
     if tokens.dim() == 3:
         tokens = tokens.squeeze(1)
         attention_mask = attention_mask.squeeze(1)
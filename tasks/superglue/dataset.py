@@ -212,7 +212,7 @@ class SuperGlueDataset(Dataset):
                 eos_id = self.tokenizer.get_command('eos').Id
                 cls_id = self.tokenizer.get_command('ENC').Id
                 input_ids = [cls_id] + sample + [eos_id]
-                sample = {'text': input_ids, 'loss_mask': np.array([1] * len(input_ids))}
+                sample = {'text': input_ids, 'loss_mask': np.array([1] * len(input_ids), dtype=np.int64)}
         else:
             sample = self.processor.encode(example, self.tokenizer, self.seq_length, self.args)
         return sample
@@ -0,0 +1,41 @@
+import numpy as np
+import torch
+from tasks.data_utils import my_collate, FlatBatch
+
+
+def build_batch():
+    samples = [{'text': np.arange(6, dtype=np.int64) + i, 'label': i,
+                'position': np.arange(12, dtype=np.int64).reshape(2, 6),
+                'loss_mask': np.ones(6, dtype=np.float32) * i,
+                'uid': 'sample-{}'.format(i)} for i in range(3)]
+    batch = my_collate(samples)
+    batch['scale'] = torch.tensor(0.5)
+    batch['transposed'] = torch.arange(12, dtype=torch.float).view(3, 4).t()
+    assert not batch['transposed'].is_contiguous()
+    return batch
+
+
+def main():
+    batch = build_batch()
+    tensors = {key: value.clone() for key, value in batch.items() if torch.is_tensor(value)}
+    flat_batch = FlatBatch(batch)
+    assert set(flat_batch.buffers) == {torch.int64, torch.float}
+    assert flat_batch.others == {'uid': ['sample-0', 'sample-1', 'sample-2']}
+
+    if not torch.cuda.is_available():
+        # Pinning host memory also needs a CUDA device.
+        print('CUDA is not available, skipping pin_memory and cuda checks')
+        return
+    flat_batch = flat_batch.pin_memory()
+    assert all(buffer.is_pinned() for buffer in flat_batch.buffers.values())
+
+    cuda_batch = flat_batch.cuda(non_blocking=True)
+    torch.cuda.synchronize()
+    assert set(cuda_batch) == set(tensors) | {'uid'}
+    assert cuda_batch['uid'] == ['sample-0', 'sample-1', 'sample-2']
+    for key, value in tensors.items():
+        output = cuda_batch[key]
+        assert output.is_cuda, key
+        assert output.shape == value.shape and output.dtype == value.dtype, key
+        assert torch.equal(output.cpu(), value), key
+    print('FlatBatch round trip passed')
@@ -1,3 +1,5 @@
+import contextlib
+
 import deepspeed
 import torch
 #from apex.optimizers import FusedAdam as Adam
@@ -148,8 +150,11 @@ def get_model(args, model_type=None, multi_token=True, num_labels=None, spell_le
     if not args.deepspeed and (args.train_iters or args.epochs):
         if args.DDP_impl == 'torch':
             i = torch.cuda.current_device()
+            # Checkpointed layers are re-run during backward, so DDP has to treat
+            # the graph as static instead of re-discovering it every iteration.
             model = TorchDDP(model, device_ids=[i], output_device=i,
-                             process_group=mpu.get_data_parallel_group())
+                             process_group=mpu.get_data_parallel_group(),
+                             static_graph=args.checkpoint_activations)
         elif args.DDP_impl == 'local':
             model = LocalDDP(model)
         else:
@@ -268,8 +273,9 @@ def setup_model_and_optimizer(args, model_type=None, multi_token=True, num_label
     return model, optimizer, lr_scheduler
 
 
-def backward_step(optimizer, model, lm_loss, args, timers):
-    """Backward step."""
+def backward_step(optimizer, model, lm_loss, args, timers, scaler=None, sync_grads=True):
+    """Backward step. With sync_grads=False the gradients are only accumulated
+    locally; they are reduced, unscaled and clipped on the final micro-step."""
 
     # Total loss.
     loss = lm_loss
@@ -279,12 +285,19 @@ def backward_step(optimizer, model, lm_loss, args, timers):
         model.backward(loss)
     else:
         # optimizer.zero_grad()
-        if args.fp16:
-            optimizer.backward(loss, update_master_grads=False)
+        if not sync_grads and isinstance(model, TorchDDP):
+            sync_context = model.no_sync()
         else:
-            loss.backward()
+            sync_context = contextlib.nullcontext()
+        with sync_context:
+            if args.fp16:
+                optimizer.backward(loss, update_master_grads=False)
+            elif scaler is not None:
+                scaler.scale(loss).backward()
+            else:
+                loss.backward()
 
-    if args.deepspeed or args.DDP_impl == 'torch':
+    if args.deepspeed or args.DDP_impl == 'torch' or not sync_grads:
         # DeepSpeed backward propagation already addressed all reduce communication.
         # Reset the timer to avoid breaking timer logs below.
         timers('allreduce').reset()
@@ -294,13 +307,15 @@ def backward_step(optimizer, model, lm_loss, args, timers):
         timers('allreduce').stop()
 
     # Update master gradients.
-    if not args.deepspeed:
+    if not args.deepspeed and sync_grads:
         if args.fp16:
             optimizer.update_master_grads()
 
         # Clipping gradients helps prevent the exploding gradient.
         if args.clip_grad > 0:
             if not args.fp16:
+                if scaler is not None:
+                    scaler.unscale_(optimizer)
                 mpu.clip_grad_norm(model.parameters(), args.clip_grad)
             else:
                 optimizer.clip_master_grads(args.clip_grad)
@@ -323,17 +338,26 @@ def see_memory_usage(message, force=False):
 
 
 def train_step(data_iterator, model, optimizer, lr_scheduler, args, timers, forward_step_func, mems=None,
-               single_step=False):
+               single_step=False, scaler=None):
     """Single training step."""
     lm_loss_total, count = 0.0, 0
     mems = [] if mems is None else mems
     if not args.deepspeed:
-        optimizer.zero_grad()
+        # Dropping the gradients lets the next backward allocate them instead of
+        # writing zeros over every gradient buffer first.
+        set_to_none = not args.zero_grads_in_place
+        if args.fp16:
+            optimizer.zero_grad(set_grads_to_None=set_to_none)
+        else:
+            optimizer.zero_grad(set_to_none=set_to_none)
     while True:
         skipped_iter, complete = 0, False
         # Forward model for one step.
         timers('forward').start()
-        lm_loss, mems, _ = forward_step_func(data_iterator, model, args, timers, mems)
+        # With a GradScaler (--amp) the forward runs under autocast: matmuls in half
+        # precision, reductions such as the cross entropy in fp32.
+        with torch.autocast(device_type="cuda", enabled=scaler is not None):
+            lm_loss, mems, _ = forward_step_func(data_iterator, model, args, timers, mems)
         timers('forward').stop()
         # print_rank_0("Forward step")
         if not args.deepspeed:
@@ -349,7 +373,9 @@ def train_step(data_iterator, model, optimizer, lr_scheduler, args, timers, forw
 
             # Calculate gradients, reduce across processes, and clip.
             timers('backward').start()
-            backward_step(optimizer, model, lm_loss, args, timers)
+            # Gradients only need to be reduced on the last accumulation micro-step.
+            sync_grads = single_step or count == args.gradient_accumulation_steps
+            backward_step(optimizer, model, lm_loss, args, timers, scaler=scaler, sync_grads=sync_grads)
             timers('backward').stop()
             # print_rank_0("Backward step")
             # Update parameters.
@@ -366,10 +392,18 @@ def train_step(data_iterator, model, optimizer, lr_scheduler, args, timers, forw
                     model.step()
             else:
                 if count == args.gradient_accumulation_steps:
-                    optimizer.step()
+                    if scaler is not None:
+                        # The scaler skips the step and lowers the scale on inf/nan gradients.
+                        loss_scale = scaler.get_scale()
+                        scaler.step(optimizer)
+                        scaler.update()
+                        overflow = scaler.get_scale() < loss_scale
+                    else:
+                        optimizer.step()
+                        overflow = args.fp16 and optimizer.overflow
                     complete = True
                     # Update learning rate.
-                    if not (args.fp16 and optimizer.overflow):
+                    if not overflow:
                         lr_scheduler.step()
                     else:
                         skipped_iter = 1
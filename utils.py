@@ -222,7 +222,7 @@ def save_zero_checkpoint(args, iteration, optimizer):
 
 
 def save_checkpoint(iteration, model, optimizer, lr_scheduler, args, tag=None, barrier=True,
-                    only_changed_parameters=False, no_deepspeed=False, no_save_optim=False):
+                    only_changed_parameters=False, no_deepspeed=False, no_save_optim=False, scaler=None):
     """Save a model checkpoint."""
     if tag is None:
         tag = str(iteration)
@@ -252,6 +252,8 @@ def save_checkpoint(iteration, model, optimizer, lr_scheduler, args, tag=None, b
                     sd['optimizer'] = optimizer.state_dict()
                 if lr_scheduler is not None:
                     sd['lr_scheduler'] = lr_scheduler.state_dict()
+                if scaler is not None:
+                    sd['scaler'] = scaler.state_dict()
 
             # rng states.
             if not args.no_save_rng:
@@ -324,7 +326,8 @@ def get_checkpoint_iteration(load_path):
     return load_path, metastring, release, True
 
 
-def load_checkpoint(model, optimizer, lr_scheduler, args, no_deepspeed=False, no_load_optim=False, no_load_rng=False):
+def load_checkpoint(model, optimizer, lr_scheduler, args, no_deepspeed=False, no_load_optim=False, no_load_rng=False,
+                    scaler=None):
     """Load a model checkpoint."""
 
     load_dir, tag, release, success = get_checkpoint_iteration(args.load)
@@ -377,6 +380,15 @@ def load_checkpoint(model, optimizer, lr_scheduler, args, no_deepspeed=False, no
                              'attempting to load the optimizer '
                              'state.'.format(checkpoint_name))
 
+        # Loss scaler. Restored on finetune loads too, so a resumed --amp run
+        # does not back off from the default scale again.
+        if scaler is not None and not release and not args.no_load_optim and not no_load_optim:
+            if 'scaler' in sd:
+                scaler.load_state_dict(sd['scaler'])
+            else:
+                print_rank_0('Unable to load loss scaler from checkpoint {}, '
+                             'starting from the default scale.'.format(checkpoint_name))
+
     # Iterations.
     if args.finetune or release:
         iteration = 0